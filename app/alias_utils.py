@@ -216,13 +216,12 @@ def delete_alias(alias: Alias, user: User):
                     user_id=user.id, email=alias.email, domain_id=alias.custom_domain_id
                 )
             )
-            Session.commit()
     else:
         if not DeletedAlias.get_by(email=alias.email):
             LOG.d("add %s to global trash", alias)
             Session.add(DeletedAlias(email=alias.email))
-            Session.commit()
 
+    # the trash entry and the alias deletion are committed together
     Alias.filter(Alias.id == alias.id).delete()
     Session.commit()
 
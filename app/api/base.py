@@ -1,7 +1,9 @@
 from functools import wraps
+from typing import Iterable
 
 import arrow
-from flask import Blueprint, request, jsonify, g
+import orjson
+from flask import Blueprint, Response, request, jsonify, g, stream_with_context
 from flask_login import current_user
 
 from app.db import Session
@@ -10,6 +12,52 @@ from app.models import ApiKey
 api_bp = Blueprint(name="api", import_name=__name__, url_prefix="/api")
 
 
+def _orjson_dumps(obj) -> bytes:
+    # values that orjson can't serialize natively (e.g. Arrow) are converted using str()
+    return orjson.dumps(obj, default=str, option=orjson.OPT_NAIVE_UTC)
+
+
+def fast_jsonify(**kwargs) -> Response:
+    """Same as flask.jsonify but use orjson that is much faster on large payloads"""
+    return Response(_orjson_dumps(kwargs), mimetype="application/json")
+
+
+def etag_jsonify(**kwargs) -> Response:
+    """fast_jsonify with an ETag computed from the body.
+    If the client already has this version (If-None-Match header), an empty 304 is returned instead.
+    The response must be returned as-is, without a status code.
+    """
+    response = fast_jsonify(**kwargs)
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+def stream_jsonify(key: str, items: Iterable, **kwargs) -> Response:
+    """Return {key: [items], **kwargs} as a streamed JSON response:
+    the items are serialized one by one while they are produced, so the whole list
+    is never built in memory and the client starts receiving data earlier.
+    A callable kwargs value is only called once all items are produced,
+    e.g. for a cursor computed while streaming the items.
+    """
+
+    def generate():
+        yield b"{" + _orjson_dumps(key) + b":["
+        for i, item in enumerate(items):
+            if i > 0:
+                yield b","
+            yield _orjson_dumps(item)
+        yield b"]"
+
+        for k, v in kwargs.items():
+            if callable(v):
+                v = v()
+            yield b"," + _orjson_dumps(k) + b":" + _orjson_dumps(v)
+        yield b"}"
+
+    # keep the request context, and therefore the db session, alive while streaming
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+
 def require_api_auth(f):
     @wraps(f)
     def decorated(*args, **kwargs):
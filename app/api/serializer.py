@@ -18,6 +18,13 @@ from app.models import (
 )
 
 
+def format_date(date: Arrow) -> str:
+    """Same output as Arrow.format(), e.g. "2020-02-21 11:35:00+00:00",
+    without going through the Arrow format token parser on every call
+    """
+    return date.datetime.isoformat(sep=" ", timespec="seconds")
+
+
 @dataclass
 class AliasInfo:
     alias: Alias
@@ -36,28 +43,12 @@ class AliasInfo:
         return mailbox_id in [m.id for m in self.mailboxes]
 
 
-def serialize_alias_info(alias_info: AliasInfo) -> dict:
-    return {
-        # Alias field
-        "id": alias_info.alias.id,
-        "email": alias_info.alias.email,
-        "creation_date": alias_info.alias.created_at.format(),
-        "creation_timestamp": alias_info.alias.created_at.timestamp,
-        "enabled": alias_info.alias.enabled,
-        "note": alias_info.alias.note,
-        # activity
-        "nb_forward": alias_info.nb_forward,
-        "nb_block": alias_info.nb_blocked,
-        "nb_reply": alias_info.nb_reply,
-    }
-
-
 def serialize_alias_info_v2(alias_info: AliasInfo) -> dict:
     res = {
         # Alias field
         "id": alias_info.alias.id,
         "email": alias_info.alias.email,
-        "creation_date": alias_info.alias.created_at.format(),
+        "creation_date": format_date(alias_info.alias.created_at),
         "creation_timestamp": alias_info.alias.created_at.timestamp,
         "enabled": alias_info.alias.enabled,
         "note": alias_info.alias.note,
@@ -93,46 +84,115 @@ def serialize_alias_info_v2(alias_info: AliasInfo) -> dict:
     return res
 
 
-def serialize_contact(contact: Contact, existed=False) -> dict:
+def serialize_contact(
+    contact: Contact,
+    existed=False,
+    last_reply_at: Optional[Arrow] = None,
+    user: Optional[User] = None,
+) -> dict:
+    """
+    last_reply_at: when the most recent reply to this contact was sent, if any
+    user: the contact owner, passed when serializing a list of contacts
+    """
     res = {
         "id": contact.id,
-        "creation_date": contact.created_at.format(),
+        "creation_date": format_date(contact.created_at),
         "creation_timestamp": contact.created_at.timestamp,
         "last_email_sent_date": None,
         "last_email_sent_timestamp": None,
         "contact": contact.website_email,
-        "reverse_alias": contact.website_send_to(),
+        "reverse_alias": contact.website_send_to(user),
         "reverse_alias_address": contact.reply_email,
         "existed": existed,
         "block_forward": contact.block_forward,
     }
 
-    email_log: EmailLog = contact.last_reply()
-    if email_log:
-        res["last_email_sent_date"] = email_log.created_at.format()
-        res["last_email_sent_timestamp"] = email_log.created_at.timestamp
+    if last_reply_at:
+        res["last_email_sent_date"] = format_date(last_reply_at)
+        res["last_email_sent_timestamp"] = last_reply_at.timestamp
 
     return res
 
 
-def get_alias_infos_with_pagination(user, page_id=0, query=None) -> [AliasInfo]:
-    ret = []
-    q = (
-        Session.query(Alias)
-        .options(joinedload(Alias.mailbox))
-        .filter(Alias.user_id == user.id)
-        .order_by(Alias.created_at.desc())
-    )
+def get_aliases_with_pagination(user, page_id=0, query=None, after_id=None) -> [dict]:
+    """return a page of serialized aliases, used by the v1 GET /api/aliases.
+    Only the needed columns are loaded, as plain tuples, to avoid the ORM overhead.
+
+    Aliases are ordered by id, most recent first, for both pagination modes so a client can
+    switch from page_id to the after_id cursor.
+    If after_id is set, use keyset pagination: return aliases whose id is smaller than after_id.
+    Otherwise fall back to the offset pagination based on page_id
+    """
+    q = Session.query(
+        Alias.id, Alias.email, Alias.created_at, Alias.enabled, Alias.note
+    ).filter(Alias.user_id == user.id)
 
     if query:
         q = q.filter(
             or_(Alias.email.ilike(f"%{query}%"), Alias.note.ilike(f"%{query}%"))
         )
 
-    q = q.limit(PAGE_LIMIT).offset(page_id * PAGE_LIMIT)
+    q = q.order_by(Alias.id.desc())
+    if after_id is not None:
+        q = q.filter(Alias.id < after_id)
+    else:
+        q = q.offset(page_id * PAGE_LIMIT)
+
+    rows = q.limit(PAGE_LIMIT).all()
+
+    # count the activities of all aliases in one query
+    alias_stats = {}
+    if rows:
+        q = (
+            Session.query(
+                Contact.alias_id,
+                func.sum(case([(EmailLog.is_reply, 1)], else_=0)),
+                func.sum(
+                    case(
+                        [(and_(EmailLog.is_reply.is_(False), EmailLog.blocked), 1)],
+                        else_=0,
+                    )
+                ),
+                func.sum(
+                    case(
+                        [
+                            (
+                                and_(
+                                    EmailLog.is_reply.is_(False),
+                                    EmailLog.blocked.is_(False),
+                                ),
+                                1,
+                            )
+                        ],
+                        else_=0,
+                    )
+                ),
+            )
+            .join(EmailLog, EmailLog.contact_id == Contact.id)
+            .filter(Contact.alias_id.in_([row.id for row in rows]))
+            .group_by(Contact.alias_id)
+        )
+        for alias_id, nb_reply, nb_blocked, nb_forward in q:
+            alias_stats[alias_id] = (nb_reply, nb_blocked, nb_forward)
 
-    for alias in q:
-        ret.append(get_alias_info(alias))
+    ret = []
+    for alias_id, email, created_at, enabled, note in rows:
+        nb_reply, nb_blocked, nb_forward = alias_stats.get(alias_id, (0, 0, 0))
+        ret.append(
+            {
+                # Alias field
+                "id": alias_id,
+                "email": email,
+                "creation_date": format_date(created_at),
+                "creation_timestamp": created_at.timestamp,
+                "enabled": enabled,
+                "note": note,
+                # activity
+                "nb_forward": nb_forward,
+                "nb_block": nb_blocked,
+                "nb_reply": nb_reply,
+            }
+        )
 
     return ret
 
@@ -222,33 +282,6 @@ def get_alias_infos_with_pagination_v3(
     return ret
 
 
-def get_alias_info(alias: Alias) -> AliasInfo:
-    q = (
-        Session.query(Contact, EmailLog)
-        .filter(Contact.alias_id == alias.id)
-        .filter(EmailLog.contact_id == Contact.id)
-    )
-
-    alias_info = AliasInfo(
-        alias=alias,
-        nb_blocked=0,
-        nb_forward=0,
-        nb_reply=0,
-        mailbox=alias.mailbox,
-        mailboxes=[alias.mailbox],
-    )
-
-    for _, el in q:
-        if el.is_reply:
-            alias_info.nb_reply += 1
-        elif el.blocked:
-            alias_info.nb_blocked += 1
-        else:
-            alias_info.nb_forward += 1
-
-    return alias_info
-
-
 def get_alias_info_v2(alias: Alias, mailbox=None) -> AliasInfo:
     if not mailbox:
         mailbox = alias.mailbox
@@ -298,17 +331,41 @@ def get_alias_info_v2(alias: Alias, mailbox=None) -> AliasInfo:
     return alias_info
 
 
-def get_alias_contacts(alias, page_id: int) -> [dict]:
-    q = (
-        Contact.filter_by(alias_id=alias.id)
-        .order_by(Contact.id.desc())
-        .limit(PAGE_LIMIT)
-        .offset(page_id * PAGE_LIMIT)
-    )
+def get_alias_contacts(
+    alias, page_id: int = 0, after_id: int = None, limit: int = PAGE_LIMIT
+) -> [dict]:
+    """return a page of alias contacts, most recent first.
+    If after_id is set, use keyset pagination: only contacts whose id is smaller than after_id are returned.
+    Otherwise fall back to the offset pagination based on page_id.
+    The page is always fully loaded as the whole response is needed for its ETag
+    """
+    q = Contact.filter_by(alias_id=alias.id).order_by(Contact.id.desc())
+
+    if after_id is not None:
+        q = q.filter(Contact.id < after_id)
+    else:
+        q = q.offset(page_id * limit)
+
+    q = q.limit(limit)
+    contacts = q.all()
+
+    # fetch the latest reply of all contacts in one query
+    last_reply_at = {}
+    if contacts:
+        last_reply_at = dict(
+            Session.query(EmailLog.contact_id, func.max(EmailLog.created_at))
+            .filter(EmailLog.contact_id.in_([c.id for c in contacts]))
+            .filter(EmailLog.is_reply)
+            .group_by(EmailLog.contact_id)
+        )
 
+    # all contacts belong to the alias owner
+    user = alias.user
     res = []
-    for fe in q.all():
-        res.append(serialize_contact(fe))
+    for fe in contacts:
+        res.append(
+            serialize_contact(fe, last_reply_at=last_reply_at.get(fe.id), user=user)
+        )
 
     return res
 
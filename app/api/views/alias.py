@@ -1,31 +1,120 @@
+import re
+from typing import Optional, Tuple
+
 from flanker.addresslib import address
 from flanker.addresslib.address import EmailAddress
-from flask import g
-from flask import jsonify
-from flask import request
+from flask import abort, g
+from flask import request, Response
+from sqlalchemy import and_, literal, not_, select, union_all, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import aliased
 
 from app import alias_utils
-from app.api.base import api_bp, require_api_auth
+from app.api.base import (
+    api_bp,
+    require_api_auth,
+    fast_jsonify,
+    etag_jsonify,
+    stream_jsonify,
+)
 from app.api.serializer import (
     AliasInfo,
-    serialize_alias_info,
     serialize_contact,
-    get_alias_infos_with_pagination,
+    get_aliases_with_pagination,
     get_alias_contacts,
     serialize_alias_info_v2,
     get_alias_info_v2,
     get_alias_infos_with_pagination_v3,
 )
-from app.dashboard.views.alias_log import get_alias_log
+from app.config import MAX_PAGE_LIMIT, PAGE_LIMIT
+from app.dashboard.views.alias_log import get_alias_log_rows
 from app.db import Session
 from app.email_utils import (
     generate_reply_email,
 )
 from app.log import LOG
-from app.models import Alias, Contact, Mailbox, AliasMailbox
+from app.models import (
+    Alias,
+    Contact,
+    Mailbox,
+    AliasMailbox,
+    User,
+    format_website_send_to,
+    get_email_log_action,
+)
 from app.utils import sanitize_email
 
 
+# the most common contact formats: "First Last <first@example.com>" or "first@example.com"
+# the display name must not contain an encoded-word (=?...?=), an escaped character or a separator
+# the local part is a dot-atom: no leading, trailing or consecutive dots
+_SIMPLE_ADDR = r"([\w+-]+(?:\.[\w+-]+)*)@([\w-]+(?:\.[\w-]+)+)"
+_SIMPLE_NAME_ADDR_RE = re.compile(
+    r'^\s*("?)([^"<>()=,;\\]*?)\1\s*<' + _SIMPLE_ADDR + r">\s*$", re.ASCII
+)
+_SIMPLE_ADDR_RE = re.compile(r"^\s*" + _SIMPLE_ADDR + r"\s*$", re.ASCII)
+
+
+def _parse_contact_address(contact_addr: str) -> Optional[Tuple[str, str]]:
+    """return (display name, address) or None if contact_addr is invalid.
+    Use regex for the simple formats and only fall back to flanker, which is much slower, for the others
+    """
+    # like flanker: lowercase the domain but keep the local part as-is,
+    # collapse the whitespaces of an unquoted display name
+    m = _SIMPLE_NAME_ADDR_RE.match(contact_addr)
+    if m:
+        quote, name, local_part, domain = m.groups()
+        if not quote:
+            name = " ".join(name.split())
+        return name, f"{local_part}@{domain.lower()}"
+
+    m = _SIMPLE_ADDR_RE.match(contact_addr)
+    if m:
+        local_part, domain = m.groups()
+        return "", f"{local_part}@{domain.lower()}"
+
+    full_address: EmailAddress = address.parse(contact_addr)
+    if not full_address:
+        return None
+
+    return full_address.display_name, full_address.address
+
+
+def _get_owned_alias(alias_id: int) -> Alias:
+    """return the alias if it belongs to the current user, abort with 403 otherwise"""
+    alias: Alias = Alias.get(alias_id)
+    if not alias or alias.user_id != g.user.id:
+        abort(403)
+
+    return alias
+
+
+def _get_page_id() -> Optional[int]:
+    """return page_id from the request query, None if it's missing or not an integer"""
+    return request.args.get("page_id", type=int)
+
+
+def _deprecate_page_id(response: Response) -> Response:
+    """warn the client that the offset pagination is deprecated in favor of the cursor"""
+    response.headers[
+        "Warning"
+    ] = '299 - "page_id is deprecated, use the returned next_cursor as after_id"'
+    return response
+
+
+def _get_limit() -> Optional[int]:
+    """return the page size from the request query, PAGE_LIMIT if it's missing.
+    None if it's not an integer between 1 and MAX_PAGE_LIMIT"""
+    if "limit" not in request.args:
+        return PAGE_LIMIT
+
+    # without default, get() returns None if limit isn't an integer
+    limit = request.args.get("limit", type=int)
+    if limit is None or not 0 < limit <= MAX_PAGE_LIMIT:
+        return None
+    return limit
+
+
 @api_bp.route("/aliases", methods=["GET", "POST"])
 @require_api_auth
 def get_aliases():
@@ -33,6 +122,8 @@ def get_aliases():
     Get aliases
     Input:
         page_id: in query
+        after_id (optional): in query, the next_cursor returned by the previous call.
+            If set, page_id is ignored
     Output:
         - aliases: list of alias:
             - id
@@ -43,29 +134,32 @@ def get_aliases():
             - nb_block
             - nb_reply
             - note
+        - next_cursor: to pass as after_id to get the next page. null if no alias.
 
     """
     user = g.user
-    try:
-        page_id = int(request.args.get("page_id"))
-    except (ValueError, TypeError):
-        return jsonify(error="page_id must be provided in request query"), 400
+    after_id = request.args.get("after_id", type=int)
+    page_id = _get_page_id()
+    if after_id is None and page_id is None:
+        return fast_jsonify(error="page_id must be provided in request query"), 400
 
     query = None
     data = request.get_json(silent=True)
     if data:
         query = data.get("query")
 
-    alias_infos: [AliasInfo] = get_alias_infos_with_pagination(
-        user, page_id=page_id, query=query
+    aliases = get_aliases_with_pagination(
+        user, page_id=page_id, query=query, after_id=after_id
     )
 
-    return (
-        jsonify(
-            aliases=[serialize_alias_info(alias_info) for alias_info in alias_infos]
-        ),
-        200,
+    response = etag_jsonify(
+        aliases=aliases,
+        next_cursor=min(a["id"] for a in aliases) if aliases else None,
     )
+    if after_id is None:
+        _deprecate_page_id(response)
+
+    return response
 
 
 @api_bp.route("/v2/aliases", methods=["GET", "POST"])
@@ -100,10 +194,9 @@ def get_aliases_v2():
 
     """
     user = g.user
-    try:
-        page_id = int(request.args.get("page_id"))
-    except (ValueError, TypeError):
-        return jsonify(error="page_id must be provided in request query"), 400
+    page_id = _get_page_id()
+    if page_id is None:
+        return fast_jsonify(error="page_id must be provided in request query"), 400
 
     query = None
     data = request.get_json(silent=True)
@@ -114,11 +207,8 @@ def get_aliases_v2():
         user, page_id=page_id, query=query
     )
 
-    return (
-        jsonify(
-            aliases=[serialize_alias_info_v2(alias_info) for alias_info in alias_infos]
-        ),
-        200,
+    return etag_jsonify(
+        aliases=[serialize_alias_info_v2(alias_info) for alias_info in alias_infos]
     )
 
 
@@ -134,14 +224,11 @@ def delete_alias(alias_id):
 
     """
     user = g.user
-    alias = Alias.get(alias_id)
-
-    if not alias or alias.user_id != user.id:
-        return jsonify(error="Forbidden"), 403
+    alias = _get_owned_alias(alias_id)
 
     alias_utils.delete_alias(alias, user)
 
-    return jsonify(deleted=True), 200
+    return fast_jsonify(deleted=True), 200
 
 
 @api_bp.route("/aliases/<int:alias_id>/toggle", methods=["POST"])
@@ -157,16 +244,40 @@ def toggle_alias(alias_id):
 
 
     """
-    user = g.user
-    alias: Alias = Alias.get(alias_id)
-
-    if not alias or alias.user_id != user.id:
-        return jsonify(error="Forbidden"), 403
+    # check the ownership, toggle and get the new status in one query
+    alias_table = Alias.__table__
+    enabled = Session.execute(
+        update(alias_table)
+        .where(and_(alias_table.c.id == alias_id, alias_table.c.user_id == g.user.id))
+        .values(enabled=not_(alias_table.c.enabled))
+        .returning(alias_table.c.enabled)
+    ).scalar()
+
+    if enabled is None:
+        return fast_jsonify(error="Forbidden"), 403
 
-    alias.enabled = not alias.enabled
     Session.commit()
 
-    return jsonify(enabled=alias.enabled), 200
+    return fast_jsonify(enabled=enabled), 200
+
+
+def _serialize_alias_log_row(row, alias: Alias, user: User) -> dict:
+    """row: returned by get_alias_log_rows"""
+    if row.is_reply:
+        from_, to = alias.email, row.website_email
+    else:
+        from_, to = row.website_email, alias.email
+
+    return {
+        "timestamp": row.created_at.timestamp,
+        "reverse_alias": format_website_send_to(
+            user, row.name, row.website_email, row.website_from, row.reply_email
+        ),
+        "reverse_alias_address": row.reply_email,
+        "from": from_,
+        "to": to,
+        "action": get_email_log_action(row.is_reply, row.blocked, row.bounced),
+    }
 
 
 @api_bp.route("/aliases/<int:alias_id>/activities")
@@ -176,6 +287,9 @@ def get_alias_activities(alias_id):
     Get aliases
     Input:
         page_id: in query
+        after_id (optional): in query, the next_cursor returned by the previous call.
+            If set, page_id is ignored
+        limit (optional): in query, the number of activities per page, PAGE_LIMIT by default
     Output:
         - activities: list of activity:
             - from
@@ -183,46 +297,38 @@ def get_alias_activities(alias_id):
             - timestamp
             - action: forward|reply|block|bounced
             - reverse_alias
+        - next_cursor: to pass as after_id to get the next page. null if no activity.
 
     """
-    user = g.user
-    try:
-        page_id = int(request.args.get("page_id"))
-    except (ValueError, TypeError):
-        return jsonify(error="page_id must be provided in request query"), 400
-
-    alias: Alias = Alias.get(alias_id)
-
-    if not alias or alias.user_id != user.id:
-        return jsonify(error="Forbidden"), 403
-
-    alias_logs = get_alias_log(alias, page_id)
-
-    activities = []
-    for alias_log in alias_logs:
-        activity = {
-            "timestamp": alias_log.when.timestamp,
-            "reverse_alias": alias_log.reverse_alias,
-            "reverse_alias_address": alias_log.contact.reply_email,
-        }
-        if alias_log.is_reply:
-            activity["from"] = alias_log.alias
-            activity["to"] = alias_log.website_email
-            activity["action"] = "reply"
-        else:
-            activity["to"] = alias_log.alias
-            activity["from"] = alias_log.website_email
-
-            if alias_log.bounced:
-                activity["action"] = "bounced"
-            elif alias_log.blocked:
-                activity["action"] = "block"
-            else:
-                activity["action"] = "forward"
-
-        activities.append(activity)
+    after_id = request.args.get("after_id", type=int)
+    page_id = _get_page_id()
+    if after_id is None and page_id is None:
+        return fast_jsonify(error="page_id must be provided in request query"), 400
+
+    limit = _get_limit()
+    if limit is None:
+        return fast_jsonify(error=f"limit must be between 1 and {MAX_PAGE_LIMIT}"), 400
+
+    alias = _get_owned_alias(alias_id)
+
+    # big pages are lazily fetched while the response is streamed
+    rows = get_alias_log_rows(alias, page_id=page_id, after_id=after_id, limit=limit)
+    next_cursor = None
+
+    def serialize_rows():
+        nonlocal next_cursor
+        for row in rows:
+            if next_cursor is None or row.id < next_cursor:
+                next_cursor = row.id
+            yield _serialize_alias_log_row(row, alias, g.user)
+
+    response = stream_jsonify(
+        "activities", serialize_rows(), next_cursor=lambda: next_cursor
+    )
+    if after_id is None:
+        _deprecate_page_id(response)
 
-    return jsonify(activities=activities), 200
+    return response, 200
 
 
 @api_bp.route("/aliases/<int:alias_id>", methods=["PUT", "PATCH"])
@@ -241,13 +347,10 @@ def update_alias(alias_id):
     """
     data = request.get_json()
     if not data:
-        return jsonify(error="request body cannot be empty"), 400
+        return fast_jsonify(error="request body cannot be empty"), 400
 
     user = g.user
-    alias: Alias = Alias.get(alias_id)
-
-    if not alias or alias.user_id != user.id:
-        return jsonify(error="Forbidden"), 403
+    alias = _get_owned_alias(alias_id)
 
     changed = False
     if "note" in data:
@@ -259,7 +362,7 @@ def update_alias(alias_id):
         mailbox_id = int(data.get("mailbox_id"))
         mailbox = Mailbox.get(mailbox_id)
         if not mailbox or mailbox.user_id != user.id or not mailbox.verified:
-            return jsonify(error="Forbidden"), 400
+            return fast_jsonify(error="Forbidden"), 400
 
         alias.mailbox_id = mailbox_id
         changed = True
@@ -272,11 +375,11 @@ def update_alias(alias_id):
         for mailbox_id in mailbox_ids:
             mailbox = Mailbox.get(mailbox_id)
             if not mailbox or mailbox.user_id != user.id or not mailbox.verified:
-                return jsonify(error="Forbidden"), 400
+                return fast_jsonify(error="Forbidden"), 400
             mailboxes.append(mailbox)
 
         if not mailboxes:
-            return jsonify(error="Must choose at least one mailbox"), 400
+            return fast_jsonify(error="Must choose at least one mailbox"), 400
 
         # <<< update alias mailboxes >>>
         # first remove all existing alias-mailboxes links
@@ -297,7 +400,7 @@ def update_alias(alias_id):
         # to make sure alias name doesn't contain linebreak
         new_name = data.get("name")
         if new_name and len(new_name) > 128:
-            return jsonify(error="Name can't be longer than 128 characters"), 400
+            return fast_jsonify(error="Name can't be longer than 128 characters"), 400
 
         if new_name:
             new_name = new_name.replace("\n", "")
@@ -315,7 +418,7 @@ def update_alias(alias_id):
     if changed:
         Session.commit()
 
-    return jsonify(ok=True), 200
+    return fast_jsonify(ok=True), 200
 
 
 @api_bp.route("/aliases/<int:alias_id>", methods=["GET"])
@@ -333,12 +436,12 @@ def get_alias(alias_id):
     alias: Alias = Alias.get(alias_id)
 
     if not alias:
-        return jsonify(error="Unknown error"), 400
+        return fast_jsonify(error="Unknown error"), 400
 
     if alias.user_id != user.id:
-        return jsonify(error="Forbidden"), 403
+        return fast_jsonify(error="Forbidden"), 403
 
-    return jsonify(**serialize_alias_info_v2(get_alias_info_v2(alias))), 200
+    return etag_jsonify(**serialize_alias_info_v2(get_alias_info_v2(alias)))
 
 
 @api_bp.route("/aliases/<int:alias_id>/contacts")
@@ -348,6 +451,9 @@ def get_alias_contacts_route(alias_id):
     Get alias contacts
     Input:
         page_id: in query
+        after_id (optional): in query, the next_cursor returned by the previous call.
+            If set, page_id is ignored
+        limit (optional): in query, the number of contacts per page, PAGE_LIMIT by default
     Output:
         - contacts: list of contacts:
             - creation_date
@@ -356,22 +462,66 @@ def get_alias_contacts_route(alias_id):
             - last_email_sent_timestamp
             - contact
             - reverse_alias
+        - next_cursor: to pass as after_id to get the next page. null if no contact.
 
     """
-    user = g.user
-    try:
-        page_id = int(request.args.get("page_id"))
-    except (ValueError, TypeError):
-        return jsonify(error="page_id must be provided in request query"), 400
+    after_id = request.args.get("after_id", type=int)
+    page_id = _get_page_id()
+    if after_id is None and page_id is None:
+        return fast_jsonify(error="page_id must be provided in request query"), 400
 
-    alias: Alias = Alias.get(alias_id)
+    limit = _get_limit()
+    if limit is None:
+        return fast_jsonify(error=f"limit must be between 1 and {MAX_PAGE_LIMIT}"), 400
 
-    if alias.user_id != user.id:
-        return jsonify(error="Forbidden"), 403
+    alias = _get_owned_alias(alias_id)
 
-    contacts = get_alias_contacts(alias, page_id)
+    contacts = get_alias_contacts(
+        alias, page_id=page_id, after_id=after_id, limit=limit
+    )
+
+    response = etag_jsonify(
+        contacts=contacts, next_cursor=contacts[-1]["id"] if contacts else None
+    )
+    if after_id is None:
+        _deprecate_page_id(response)
+
+    return response
+
+
+def _insert_or_get_contact(
+    alias: Alias, website_email: str, name: Optional[str], reply_email: str
+) -> Optional[Tuple[Contact, bool]]:
+    """Create the contact or, if the alias already has a contact for website_email,
+    return the existing one, in a single query.
+    Return (contact, existed) or None if the contact has been created by a concurrent transaction
+    in the meantime.
+    """
+    contact_table = Contact.__table__
+    new_contact = (
+        insert(contact_table)
+        .values(
+            user_id=alias.user_id,
+            alias_id=alias.id,
+            website_email=website_email,
+            name=name,
+            reply_email=reply_email,
+        )
+        .on_conflict_do_nothing(constraint="uq_contact")
+        .returning(*contact_table.c)
+        .cte("new_contact")
+    )
+    contacts = union_all(
+        select([new_contact, literal(False).label("existed")]),
+        select([contact_table, literal(True).label("existed")]).where(
+            and_(
+                contact_table.c.alias_id == alias.id,
+                contact_table.c.website_email == website_email,
+            )
+        ),
+    ).alias()
 
-    return jsonify(contacts=contacts), 200
+    return Session.query(aliased(Contact, contacts), contacts.c.existed).first()
 
 
 @api_bp.route("/aliases/<int:alias_id>/contacts", methods=["POST"])
@@ -390,44 +540,54 @@ def create_contact_route(alias_id):
     """
     data = request.get_json()
     if not data:
-        return jsonify(error="request body cannot be empty"), 400
+        return fast_jsonify(error="request body cannot be empty"), 400
 
     user = g.user
-    alias: Alias = Alias.get(alias_id)
-
-    if alias.user_id != user.id:
-        return jsonify(error="Forbidden"), 403
+    alias = _get_owned_alias(alias_id)
 
     contact_addr = data.get("contact")
 
     if not contact_addr:
-        return jsonify(error="Contact cannot be empty"), 400
+        return fast_jsonify(error="Contact cannot be empty"), 400
 
-    full_address: EmailAddress = address.parse(contact_addr)
-    if not full_address:
-        return jsonify(error=f"invalid contact email {contact_addr}"), 400
+    parsed = _parse_contact_address(contact_addr)
+    if not parsed:
+        return fast_jsonify(error=f"invalid contact email {contact_addr}"), 400
 
-    contact_name, contact_email = full_address.display_name, full_address.address
+    contact_name, contact_email = parsed
 
     contact_email = sanitize_email(contact_email, not_lower=True)
 
+    reply_email = generate_reply_email(contact_email, user)
+    row = _insert_or_get_contact(alias, contact_email, contact_name, reply_email)
+    if row:
+        contact, existed = row
+    else:
+        # the contact has just been created by a concurrent request
+        contact = Contact.get_by(alias_id=alias.id, website_email=contact_email)
+        existed = True
+
     # already been added
-    contact = Contact.get_by(alias_id=alias.id, website_email=contact_email)
-    if contact:
-        return jsonify(**serialize_contact(contact, existed=True)), 200
-
-    contact = Contact.create(
-        user_id=alias.user_id,
-        alias_id=alias.id,
-        website_email=contact_email,
-        name=contact_name,
-        reply_email=generate_reply_email(contact_email, user),
-    )
+    if existed:
+        last_reply = contact.last_reply()
+        return (
+            fast_jsonify(
+                **serialize_contact(
+                    contact,
+                    existed=True,
+                    last_reply_at=last_reply.created_at if last_reply else None,
+                    user=user,
+                )
+            ),
+            200,
+        )
 
     LOG.d("create reverse-alias for %s %s", contact_addr, alias)
+    # serialize before committing as the commit expires the contact attributes
+    res = serialize_contact(contact, user=user)
     Session.commit()
 
-    return jsonify(**serialize_contact(contact)), 201
+    return fast_jsonify(**res), 201
 
 
 @api_bp.route("/contacts/<int:contact_id>", methods=["DELETE"])
@@ -444,12 +604,12 @@ def delete_contact(contact_id):
     contact = Contact.get(contact_id)
 
     if not contact or contact.alias.user_id != user.id:
-        return jsonify(error="Forbidden"), 403
+        return fast_jsonify(error="Forbidden"), 403
 
     Contact.delete(contact_id)
     Session.commit()
 
-    return jsonify(deleted=True), 200
+    return fast_jsonify(deleted=True), 200
 
 
 @api_bp.route("/contacts/<int:contact_id>/toggle", methods=["POST"])
@@ -466,9 +626,9 @@ def toggle_contact(contact_id):
     contact = Contact.get(contact_id)
 
     if not contact or contact.alias.user_id != user.id:
-        return jsonify(error="Forbidden"), 403
+        return fast_jsonify(error="Forbidden"), 403
 
     contact.block_forward = not contact.block_forward
     Session.commit()
 
-    return jsonify(block_forward=contact.block_forward), 200
+    return fast_jsonify(block_forward=contact.block_forward), 200
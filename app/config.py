@@ -268,6 +268,12 @@ JOB_DELETE_DOMAIN = "delete-domain"
 
 # for pagination
 PAGE_LIMIT = 20
+# max page size a client can ask for, e.g. to export all alias activities
+MAX_PAGE_LIMIT = 5000
+# pages bigger than YIELD_PER_THRESHOLD are streamed from the database YIELD_PER rows at a time.
+# Server-side cursors are slower than a buffered fetch for small result sets, hence the threshold
+YIELD_PER_THRESHOLD = 500
+YIELD_PER = 200
 
 # Upload to static/upload instead of s3
 LOCAL_FILE_UPLOAD = "LOCAL_FILE_UPLOAD" in os.environ
@@ -1,8 +1,10 @@
+from typing import Iterable
+
 import arrow
 from flask import render_template, flash, redirect, url_for
 from flask_login import login_required, current_user
 
-from app.config import PAGE_LIMIT
+from app.config import PAGE_LIMIT, YIELD_PER, YIELD_PER_THRESHOLD
 from app.dashboard.base import dashboard_bp
 from app.db import Session
 from app.models import Alias, EmailLog, Contact
@@ -90,3 +92,41 @@ def get_alias_log(alias: Alias, page_id=0) -> [AliasLog]:
     logs = sorted(logs, key=lambda l: l.when, reverse=True)
 
     return logs
+
+
+def get_alias_log_rows(
+    alias: Alias, page_id=0, after_id=None, limit=PAGE_LIMIT
+) -> Iterable:
+    """Same as get_alias_log but only load the needed columns, as plain tuples.
+    Used by the API where the ORM objects aren't needed.
+    The rows are ordered by id, most recent first, whatever the page size.
+    Pages bigger than YIELD_PER_THRESHOLD are returned as a lazy iterator on a server-side cursor
+    """
+    q = (
+        Session.query(
+            EmailLog.id,
+            EmailLog.created_at,
+            EmailLog.is_reply,
+            EmailLog.blocked,
+            EmailLog.bounced,
+            Contact.name,
+            Contact.website_email,
+            Contact.website_from,
+            Contact.reply_email,
+        )
+        .join(Contact, Contact.id == EmailLog.contact_id)
+        # filter on email_log.alias_id to use the (alias_id, id) index
+        .filter(EmailLog.alias_id == alias.id)
+        .order_by(EmailLog.id.desc())
+    )
+
+    if after_id is not None:
+        q = q.filter(EmailLog.id < after_id)
+    else:
+        q = q.offset(page_id * limit)
+
+    q = q.limit(limit)
+    if limit > YIELD_PER_THRESHOLD:
+        return q.yield_per(YIELD_PER)
+
+    return q.all()
@@ -1447,6 +1447,49 @@ class ClientUser(Base, ModelMixin):
         return res
 
 
+def format_website_send_to(
+    user: Optional[User],
+    name: Optional[str],
+    website_email: str,
+    website_from: Optional[str],
+    reply_email: str,
+) -> str:
+    """Contact.website_send_to() that works on plain column values,
+    for when contacts are loaded as tuples instead of Contact objects
+    """
+    email = website_email
+
+    if (
+        not user
+        or not SenderFormatEnum.has_value(user.sender_format)
+        or user.sender_format == SenderFormatEnum.AT.value
+    ):
+        email = email.replace("@", " at ")
+    elif user.sender_format == SenderFormatEnum.A.value:
+        email = email.replace("@", "(a)")
+
+    # if no name, try to parse it from website_from
+    if not name and website_from:
+        try:
+            name = address.parse(website_from).display_name
+        except Exception:
+            # Skip if website_from is wrongly formatted
+            LOG.e("Cannot parse contact %s website_from %s", reply_email, website_from)
+            name = ""
+
+    # remove all double quote
+    if name:
+        name = name.replace('"', "")
+
+    if name:
+        name = name + " | " + email
+    else:
+        name = email
+
+    # cannot use formataddr here as this field is for email client, not for MTA
+    return f'"{name}" <{reply_email}>'
+
+
 class Contact(Base, ModelMixin):
     """
     Store configuration of sender (website-email) and alias.
@@ -1456,14 +1499,15 @@ class Contact(Base, ModelMixin):
 
     __table_args__ = (
         sa.UniqueConstraint("alias_id", "website_email", name="uq_contact"),
+        # used by the keyset pagination in get_alias_contacts(),
+        # also serves the lookups on alias_id alone
+        Index("ix_contact_alias_id_id", "alias_id", "id"),
     )
 
     user_id = sa.Column(
         sa.ForeignKey(User.id, ondelete="cascade"), nullable=False, index=True
     )
-    alias_id = sa.Column(
-        sa.ForeignKey(Alias.id, ondelete="cascade"), nullable=False, index=True
-    )
+    alias_id = sa.Column(sa.ForeignKey(Alias.id, ondelete="cascade"), nullable=False)
 
     name = sa.Column(
         sa.String(512), nullable=True, default=None, server_default=text("NULL")
@@ -1511,49 +1555,22 @@ class Contact(Base, ModelMixin):
     def email(self):
         return self.website_email
 
-    def website_send_to(self):
+    def website_send_to(self, user: Optional[User] = None):
         """return the email address with name.
         to use when user wants to send an email from the alias
+        `user` is the contact owner, can be passed to avoid going through the relationship
+        when formatting a list of contacts that belong to the same user.
         Return
         "First Last | email at example.com" <reverse-alias@SL>
         """
 
-        # Prefer using contact name if possible
-        user = self.user
-        name = self.name
-        email = self.website_email
-
-        if (
-            not user
-            or not SenderFormatEnum.has_value(user.sender_format)
-            or user.sender_format == SenderFormatEnum.AT.value
-        ):
-            email = email.replace("@", " at ")
-        elif user.sender_format == SenderFormatEnum.A.value:
-            email = email.replace("@", "(a)")
-
-        # if no name, try to parse it from website_from
-        if not name and self.website_from:
-            try:
-                name = address.parse(self.website_from).display_name
-            except Exception:
-                # Skip if website_from is wrongly formatted
-                LOG.e(
-                    "Cannot parse contact %s website_from %s", self, self.website_from
-                )
-                name = ""
-
-        # remove all double quote
-        if name:
-            name = name.replace('"', "")
-
-        if name:
-            name = name + " | " + email
-        else:
-            name = email
-
-        # cannot use formataddr here as this field is for email client, not for MTA
-        return f'"{name}" <{self.reply_email}>'
+        return format_website_send_to(
+            user or self.user,
+            self.name,
+            self.website_email,
+            self.website_from,
+            self.reply_email,
+        )
 
     def new_addr(self):
         """
@@ -1596,18 +1613,35 @@ class Contact(Base, ModelMixin):
         return f"<Contact {self.id} {self.website_email} {self.alias_id}>"
 
 
+def get_email_log_action(is_reply: bool, blocked: bool, bounced: bool) -> str:
+    """return the action name of an email log: forward|reply|block|bounced.
+    Outside of EmailLog so it can be used with the columns loaded without the ORM object"""
+    if is_reply:
+        return "reply"
+    elif bounced:
+        return "bounced"
+    elif blocked:
+        return "block"
+    else:
+        return "forward"
+
+
 class EmailLog(Base, ModelMixin):
     __tablename__ = "email_log"
+    __table_args__ = (
+        # these indexes also serve the lookups on contact_id or alias_id alone
+        Index("ix_email_log_contact_id_id", "contact_id", "id"),
+        # used by the keyset pagination in get_alias_log_rows()
+        Index("ix_email_log_alias_id_id", "alias_id", "id"),
+    )
 
     user_id = sa.Column(
         sa.ForeignKey(User.id, ondelete="cascade"), nullable=False, index=True
     )
     contact_id = sa.Column(
-        sa.ForeignKey(Contact.id, ondelete="cascade"), nullable=False, index=True
-    )
-    alias_id = sa.Column(
-        sa.ForeignKey(Alias.id, ondelete="cascade"), nullable=True, index=True
+        sa.ForeignKey(Contact.id, ondelete="cascade"), nullable=False
     )
+    alias_id = sa.Column(sa.ForeignKey(Alias.id, ondelete="cascade"), nullable=True)
 
     # whether this is a reply
     is_reply = sa.Column(sa.Boolean, nullable=False, default=False)
@@ -1668,14 +1702,7 @@ class EmailLog(Base, ModelMixin):
 
     def get_action(self) -> str:
         """return the action name: forward|reply|block|bounced"""
-        if self.is_reply:
-            return "reply"
-        elif self.bounced:
-            return "bounced"
-        elif self.blocked:
-            return "block"
-        else:
-            return "forward"
+        return get_email_log_action(self.is_reply, self.blocked, self.bounced)
 
     def get_phase(self) -> str:
         if self.is_reply:
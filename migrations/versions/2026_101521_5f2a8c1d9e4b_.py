@@ -0,0 +1,29 @@
+"""empty message
+
+Revision ID: 5f2a8c1d9e4b
+Revises: ad467baf7ec8
+Create Date: 2026-10-15 21:25:10.120413
+
+"""
+import sqlalchemy_utils
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f2a8c1d9e4b'
+down_revision = 'ad467baf7ec8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # contact is a big table: create the index without locking it
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    with op.get_context().autocommit_block():
+        op.create_index('ix_contact_alias_id_id', 'contact', ['alias_id', 'id'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_contact_alias_id_id', table_name='contact', postgresql_concurrently=True)
@@ -0,0 +1,55 @@
+"""empty message
+
+Revision ID: 9c3e7b0a4f12
+Revises: 5f2a8c1d9e4b
+Create Date: 2026-10-15 21:38:02.541870
+
+"""
+import sqlalchemy_utils
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c3e7b0a4f12'
+down_revision = '5f2a8c1d9e4b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # email_log.alias_id is null for the logs created before the column was added.
+    # Fill it up by batch so the keyset pagination on (alias_id, id) sees all logs
+    # without locking the whole table
+    conn = op.get_bind()
+    max_id = conn.execute(sa.text("SELECT max(id) FROM email_log")).scalar() or 0
+    with op.get_context().autocommit_block():
+        for start in range(0, max_id, 10000):
+            conn.execute(
+                sa.text(
+                    "UPDATE email_log SET alias_id = contact.alias_id FROM contact "
+                    "WHERE email_log.contact_id = contact.id AND email_log.alias_id IS NULL "
+                    "AND email_log.id > :start AND email_log.id <= :end"
+                ),
+                start=start,
+                end=start + 10000,
+            )
+
+    # email_log is a big table: create the indexes without locking it
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    with op.get_context().autocommit_block():
+        op.create_index('ix_email_log_alias_id_id', 'email_log', ['alias_id', 'id'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_email_log_contact_id_id', 'email_log', ['contact_id', 'id'], unique=False, postgresql_concurrently=True)
+        # covered by the (alias_id, id) and (contact_id, id) indexes
+        op.drop_index('ix_email_log_alias_id', table_name='email_log', postgresql_concurrently=True)
+        op.drop_index('ix_email_log_contact_id', table_name='email_log', postgresql_concurrently=True)
+        op.drop_index('ix_contact_alias_id', table_name='contact', postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_contact_alias_id', 'contact', ['alias_id'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_email_log_contact_id', 'email_log', ['contact_id'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_email_log_alias_id', 'email_log', ['alias_id'], unique=False, postgresql_concurrently=True)
+        op.drop_index('ix_email_log_contact_id_id', table_name='email_log', postgresql_concurrently=True)
+        op.drop_index('ix_email_log_alias_id_id', table_name='email_log', postgresql_concurrently=True)
@@ -1,6 +1,6 @@
 from flask import url_for
 
-from app.config import PAGE_LIMIT
+from app.config import PAGE_LIMIT, MAX_PAGE_LIMIT
 from app.db import Session
 from app.email_utils import is_reverse_alias
 from app.models import User, ApiKey, Alias, Contact, EmailLog, Mailbox
@@ -75,6 +75,61 @@ def test_get_aliases_with_pagination(flask_client):
     assert len(r.json["aliases"]) == 2
 
 
+def test_get_aliases_with_after_id(flask_client):
+    user = login(flask_client)
+
+    # create more aliases than PAGE_LIMIT
+    for _ in range(PAGE_LIMIT + 1):
+        Alias.create_new_random(user)
+    Session.commit()
+
+    r = flask_client.get(url_for("api.get_aliases", page_id=0))
+    assert r.status_code == 200
+    assert len(r.json["aliases"]) == PAGE_LIMIT
+    next_cursor = r.json["next_cursor"]
+    assert next_cursor == min(a["id"] for a in r.json["aliases"])
+
+    # 2 aliases left as 1 alias is created when user is created
+    r = flask_client.get(url_for("api.get_aliases", after_id=next_cursor))
+    assert r.status_code == 200
+    assert "Warning" not in r.headers
+    assert len(r.json["aliases"]) == 2
+    for a in r.json["aliases"]:
+        assert a["id"] < next_cursor
+
+    # the cursor continues exactly where the offset pagination stops
+    r2 = flask_client.get(url_for("api.get_aliases", page_id=1))
+    assert "page_id is deprecated" in r2.headers["Warning"]
+    assert r2.json["aliases"] == r.json["aliases"]
+
+    r = flask_client.get(url_for("api.get_aliases", after_id="abcd"))
+    assert r.status_code == 400
+
+
+def test_get_aliases_etag(flask_client):
+    user = login(flask_client)
+
+    r = flask_client.get(url_for("api.get_aliases", page_id=0))
+    assert r.status_code == 200
+    etag = r.headers["ETag"]
+
+    # nothing has changed
+    r = flask_client.get(
+        url_for("api.get_aliases", page_id=0), headers={"If-None-Match": etag}
+    )
+    assert r.status_code == 304
+
+    # a new alias changes the ETag
+    Alias.create_new_random(user)
+    Session.commit()
+    r = flask_client.get(
+        url_for("api.get_aliases", page_id=0), headers={"If-None-Match": etag}
+    )
+    assert r.status_code == 200
+    assert len(r.json["aliases"]) == 2
+    assert r.headers["ETag"] != etag
+
+
 def test_get_aliases_query(flask_client):
     user = User.create(
         email="a@b.c", password="password", name="Test User", activated=True
@@ -284,6 +339,7 @@ def test_alias_activities(flask_client):
 
     assert r.status_code == 200
     assert len(r.json["activities"]) == PAGE_LIMIT
+    next_cursor = r.json["next_cursor"]
     for ac in r.json["activities"]:
         assert ac["from"]
         assert ac["to"]
@@ -299,6 +355,54 @@ def test_alias_activities(flask_client):
     )
     assert len(r.json["activities"]) < 3
 
+    # same using the cursor of the first page: the 2 remaining activities
+    r = flask_client.get(
+        url_for("api.get_alias_activities", alias_id=alias.id, after_id=next_cursor),
+        headers={"Authentication": api_key.code},
+    )
+    assert r.status_code == 200
+    assert len(r.json["activities"]) == 2
+
+    # no more activities
+    r = flask_client.get(
+        url_for(
+            "api.get_alias_activities",
+            alias_id=alias.id,
+            after_id=r.json["next_cursor"],
+        ),
+        headers={"Authentication": api_key.code},
+    )
+    assert r.status_code == 200
+    assert r.json["activities"] == []
+    assert r.json["next_cursor"] is None
+
+    # a page big enough to be streamed from the database
+    r = flask_client.get(
+        url_for("api.get_alias_activities", alias_id=alias.id, page_id=0, limit=1000),
+        headers={"Authentication": api_key.code},
+    )
+    assert r.status_code == 200
+    assert len(r.json["activities"]) == PAGE_LIMIT + 2
+    assert r.json["next_cursor"] == min(
+        email_log.id for email_log in EmailLog.filter_by(alias_id=alias.id)
+    )
+
+    # the order doesn't depend on the page size
+    r2 = flask_client.get(
+        url_for("api.get_alias_activities", alias_id=alias.id, page_id=0, limit=50),
+        headers={"Authentication": api_key.code},
+    )
+    assert r2.json == r.json
+
+    for limit in [0, "abc"]:
+        r = flask_client.get(
+            url_for(
+                "api.get_alias_activities", alias_id=alias.id, page_id=0, limit=limit
+            ),
+            headers={"Authentication": api_key.code},
+        )
+        assert r.status_code == 400
+
 
 def test_update_alias(flask_client):
     user = User.create(
@@ -507,6 +611,80 @@ def test_alias_contacts(flask_client):
     assert len(r.json["contacts"]) == 1
 
 
+def test_alias_contacts_with_after_id(flask_client):
+    user = login(flask_client)
+
+    alias = Alias.create_new_random(user)
+    Session.commit()
+
+    for i in range(PAGE_LIMIT + 1):
+        Contact.create(
+            website_email=f"marketing-{i}@example.com",
+            reply_email=f"reply-{i}@a.b",
+            alias_id=alias.id,
+            user_id=alias.user_id,
+        )
+    Session.commit()
+
+    # first page, without after_id
+    r = flask_client.get(f"/api/aliases/{alias.id}/contacts?page_id=0")
+    assert r.status_code == 200
+    assert len(r.json["contacts"]) == PAGE_LIMIT
+    next_cursor = r.json["next_cursor"]
+    assert next_cursor == r.json["contacts"][-1]["id"]
+    assert "page_id is deprecated" in r.headers["Warning"]
+
+    # second page, should return 1 result only
+    r = flask_client.get(f"/api/aliases/{alias.id}/contacts?after_id={next_cursor}")
+    assert r.status_code == 200
+    assert len(r.json["contacts"]) == 1
+    assert r.json["contacts"][0]["id"] < next_cursor
+    assert "Warning" not in r.headers
+
+    # no more contacts
+    next_cursor = r.json["next_cursor"]
+    r = flask_client.get(f"/api/aliases/{alias.id}/contacts?after_id={next_cursor}")
+    assert r.json["contacts"] == []
+    assert r.json["next_cursor"] is None
+
+    # invalid after_id
+    r = flask_client.get(f"/api/aliases/{alias.id}/contacts?after_id=abcd")
+    assert r.status_code == 400
+
+    # custom page size
+    r = flask_client.get(f"/api/aliases/{alias.id}/contacts?page_id=0&limit=5")
+    assert r.status_code == 200
+    assert len(r.json["contacts"]) == 5
+    r2 = flask_client.get(f"/api/aliases/{alias.id}/contacts?page_id=1&limit=5")
+    assert r2.json["contacts"][0]["id"] < r.json["next_cursor"]
+
+    r = flask_client.get(
+        f"/api/aliases/{alias.id}/contacts?page_id=0&limit={MAX_PAGE_LIMIT + 1}"
+    )
+    assert r.status_code == 400
+
+
+def test_alias_routes_forbidden_for_unknown_alias(flask_client):
+    login(flask_client)
+    other_user = User.create(
+        email="other@b.c", password="password", name="Other", activated=True
+    )
+    Session.commit()
+    other_alias = Alias.filter_by(user_id=other_user.id).first()
+
+    for alias_id in [other_alias.id, other_alias.id + 1000]:
+        r = flask_client.get(f"/api/aliases/{alias_id}/contacts?page_id=0")
+        assert r.status_code == 403
+        assert r.json["error"] == "Forbidden"
+
+        r = flask_client.post(f"/api/aliases/{alias_id}/toggle")
+        assert r.status_code == 403
+
+    # other_alias is untouched: reload it as the toggle UPDATE bypasses the session
+    Session.refresh(other_alias)
+    assert other_alias.enabled
+
+
 def test_create_contact_route(flask_client):
     user = User.create(
         email="a@b.c", password="password", name="Test User", activated=True
@@ -546,6 +724,74 @@ def test_create_contact_route(flask_client):
     assert r.json["existed"]
 
 
+def test_create_contact_route_address_formats(flask_client):
+    login(flask_client)
+    alias = Alias.first()
+
+    for contact_addr, name, email in [
+        ("first@example.com", "", "first@example.com"),
+        ('"Second Last" <second@example.com>', "Second Last", "second@example.com"),
+        ("=?UTF-8?B?VGhpcmQ=?= <third@example.com>", "Third", "third@example.com"),
+        # the domain is lowercased, not the local part
+        ("Fourth.Last@EXAMPLE.COM", "", "Fourth.Last@example.com"),
+        ("  Fifth   Last  <fifth@Example.com>", "Fifth Last", "fifth@example.com"),
+        # a comment isn't a display name
+        ("(comment) <sixth@example.com>", "", "sixth@example.com"),
+    ]:
+        r = flask_client.post(
+            url_for("api.create_contact_route", alias_id=alias.id),
+            json={"contact": contact_addr},
+        )
+
+        assert r.status_code == 201
+        assert r.json["contact"] == email
+        assert Contact.get(r.json["id"]).name == name
+
+    # same address with a different domain case
+    r = flask_client.post(
+        url_for("api.create_contact_route", alias_id=alias.id),
+        json={"contact": "Fourth.Last@example.com"},
+    )
+    assert r.status_code == 200
+    assert r.json["existed"]
+
+    for contact_addr in ["a..b@example.com", ".a@example.com", "a.@example.com"]:
+        r = flask_client.post(
+            url_for("api.create_contact_route", alias_id=alias.id),
+            json={"contact": contact_addr},
+        )
+        assert r.status_code == 400
+
+
+def test_create_contact_route_concurrent_creation(flask_client, monkeypatch):
+    login(flask_client)
+    alias = Alias.first()
+
+    def insert_concurrently(alias, website_email, name, reply_email):
+        # the contact is created by another request between the INSERT and the SELECT
+        Contact.create(
+            user_id=alias.user_id,
+            alias_id=alias.id,
+            website_email=website_email,
+            reply_email="concurrent@a.b",
+            commit=True,
+        )
+        return None
+
+    monkeypatch.setattr(
+        "app.api.views.alias._insert_or_get_contact", insert_concurrently
+    )
+
+    r = flask_client.post(
+        url_for("api.create_contact_route", alias_id=alias.id),
+        json={"contact": "First Last <first@example.com>"},
+    )
+
+    assert r.status_code == 200
+    assert r.json["existed"]
+    assert r.json["reverse_alias_address"] == "concurrent@a.b"
+
+
 def test_create_contact_route_empty_contact_address(flask_client):
     login(flask_client)
     alias = Alias.first()
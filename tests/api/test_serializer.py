@@ -1,7 +1,14 @@
-from app.api.serializer import get_alias_infos_with_pagination_v3
+import arrow
+
+from app.api.serializer import (
+    get_alias_infos_with_pagination_v3,
+    get_alias_contacts,
+    get_aliases_with_pagination,
+    format_date,
+)
 from app.config import PAGE_LIMIT
 from app.db import Session
-from app.models import User, Alias, Mailbox, Contact
+from app.models import User, Alias, Mailbox, Contact, EmailLog
 from tests.utils import create_user
 
 
@@ -203,3 +210,74 @@ def test_get_alias_infos_pinned_alias(flask_client):
     # pinned alias isn't included in the search
     alias_infos = get_alias_infos_with_pagination_v3(user, query="no match")
     assert len(alias_infos) == 0
+
+
+def test_get_alias_contacts_last_reply(flask_client):
+    user = create_user(flask_client)
+    alias = Alias.first()
+
+    c1 = Contact.create(
+        user_id=user.id,
+        alias_id=alias.id,
+        website_email="c1@example.com",
+        reply_email="re1@SL",
+    )
+    c2 = Contact.create(
+        user_id=user.id,
+        alias_id=alias.id,
+        website_email="c2@example.com",
+        reply_email="re2@SL",
+        commit=True,
+    )
+
+    # c1 has 2 replies, c2 has only a forward
+    EmailLog.create(user_id=user.id, alias_id=alias.id, contact_id=c1.id, is_reply=True)
+    el = EmailLog.create(
+        user_id=user.id, alias_id=alias.id, contact_id=c1.id, is_reply=True
+    )
+    EmailLog.create(user_id=user.id, alias_id=alias.id, contact_id=c2.id, commit=True)
+
+    contacts = {c["id"]: c for c in get_alias_contacts(alias)}
+    assert contacts[c1.id]["last_email_sent_timestamp"] == el.created_at.timestamp
+    assert contacts[c2.id]["last_email_sent_timestamp"] is None
+
+
+def test_get_aliases_with_pagination_stats(flask_client):
+    user = create_user(flask_client)
+    alias = Alias.first()
+    other_alias = Alias.create_new_random(user)
+
+    contact = Contact.create(
+        user_id=user.id,
+        alias_id=alias.id,
+        website_email="c1@example.com",
+        reply_email="re1@SL",
+        commit=True,
+    )
+    for is_reply, blocked in [(True, False), (False, True), (False, False)] * 2:
+        EmailLog.create(
+            user_id=user.id,
+            alias_id=alias.id,
+            contact_id=contact.id,
+            is_reply=is_reply,
+            blocked=blocked,
+        )
+    Session.commit()
+
+    aliases = {a["id"]: a for a in get_aliases_with_pagination(user)}
+    assert aliases[alias.id]["nb_reply"] == 2
+    assert aliases[alias.id]["nb_block"] == 2
+    assert aliases[alias.id]["nb_forward"] == 2
+
+    assert aliases[other_alias.id]["nb_reply"] == 0
+    assert aliases[other_alias.id]["nb_block"] == 0
+    assert aliases[other_alias.id]["nb_forward"] == 0
+
+
+def test_format_date():
+    for date in [
+        arrow.get("2020-02-21T11:35:00+00:00"),
+        arrow.get("2020-02-21T11:35:00.123456+00:00"),
+        arrow.utcnow(),
+    ]:
+        assert format_date(date) == date.format()
@@ -13,6 +13,8 @@ from app.models import (
     Mailbox,
     SenderFormatEnum,
     EnumE,
+    format_website_send_to,
+    get_email_log_action,
 )
 
 
@@ -110,6 +112,14 @@ def test_website_send_to(flask_client):
     c1.website_from = "=?UTF-8?B?TmjGoW4gTmd1eeG7hW4=?= <abcd@example.com>"
     assert c1.website_send_to() == '"Nhơn Nguyễn | abcd at example.com" <rep@SL>'
 
+    # same result with the column values
+    assert (
+        format_website_send_to(
+            user, None, "abcd@example.com", c1.website_from, "rep@SL"
+        )
+        == '"Nhơn Nguyễn | abcd at example.com" <rep@SL>'
+    )
+
 
 def test_new_addr(flask_client):
     user = User.create(
@@ -213,3 +223,12 @@ def test_EnumE():
 
     assert E.get_value("A") == 100
     assert E.get_value("Not existent") is None
+
+
+def test_get_email_log_action():
+    assert get_email_log_action(is_reply=True, blocked=False, bounced=False) == "reply"
+    assert get_email_log_action(is_reply=False, blocked=True, bounced=True) == "bounced"
+    assert get_email_log_action(is_reply=False, blocked=True, bounced=False) == "block"
+    assert (
+        get_email_log_action(is_reply=False, blocked=False, bounced=False) == "forward"
+    )